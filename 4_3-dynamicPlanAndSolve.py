@@ -1,6 +1,12 @@
 import ast
+import asyncio
+import hashlib
+import json
+import re
+from collections import Counter
 from dotenv import load_dotenv
 from BaseAgent import BaseAgent
+from AgentCache import SemanticCache, disk_cached
 
 
 """ 
@@ -19,7 +25,7 @@ graph TD
     H -->|否| Y[返回最终答案]
     
     F --> |FAILURE_RETRY| I{重试次数 < MAX_RETRIES?}
-    I -->|是| E
+    I -->|是, 附带上次结果重试| E
     I -->|否| J[降级为 FAILURE_REPLAN]
     
     F --> |FAILURE_REPLAN| K{重规划次数 < MAX_REPLANS?}
@@ -31,18 +37,19 @@ graph TD
 
 
 # --- Prompts ---
-PLANNER_PROMPT_TEMPLATE = """
+# 每个提示词都拆分为两部分:
+# - SYSTEM_PROMPT: 角色、规则与输出格式，在整个运行过程中保持不变
+# - USER_PROMPT: 仅包含每次调用都会变化的字段，放在消息的最后
+# 静态内容在前、动态内容在后，让服务商的提示词缓存 (Prompt Caching) 有可能复用同一个前缀。
+# 注意: 这些静态提示词只有几百个 token，低于 OpenAI 类接口 1024 token 的缓存下限，
+# 规划器与评估器的调用本身通常不会命中缓存；执行器的系统消息还包含问题、计划与历史记录，
+# 只有在这部分内容足够长时，后续步骤才能命中缓存。
+
+PLANNER_SYSTEM_PROMPT = """
 你是一个顶级的AI规划专家。你的任务是将用户提出的复杂问题分解成一个由多个简单步骤组成的行动计划。
 
-问题: {question}
-
-# 已完成的历史记录 (如果有):
-{history}
-
-# 失败信息 (如果有):
-{failure_info}
-
-请根据以上信息，生成一个新的、可行的行动计划。
+你将收到用户的问题、已完成的历史记录 (如果有) 以及失败信息 (如果有)。
+请根据这些信息，生成一个新的、可行的行动计划。
 注意事项:
 1. 如果有已完成的历史记录，你的新计划应该从这些已完成的步骤之后继续，不要重复已完成的工作。
 2. 如果有失败信息，请分析失败原因，并设计一个能够绕过或解决该问题的新计划。
@@ -54,11 +61,25 @@ PLANNER_PROMPT_TEMPLATE = """
 ```
 """
 
-EXECUTOR_PROMPT_TEMPLATE = """
+PLANNER_USER_PROMPT = """
+问题: {question}
+
+# 已完成的历史记录 (如果有):
+{history}
+
+# 失败信息 (如果有):
+{failure_info}
+"""
+
+EXECUTOR_SYSTEM_PROMPT = """
 你是一位顶级的AI执行专家。你的任务是严格按照给定的计划，一步步地解决问题。
 你将收到原始问题、完整的计划、以及到目前为止已经完成的步骤和结果。
 请你专注于解决"当前步骤"，并仅输出该步骤的最终答案，不要输出任何额外的解释或对话。
+"""
 
+# 执行器的上下文：在同一个计划内保持不变，作为系统消息的一部分发送，
+# 步骤成功后只在末尾追加一条历史记录，因此前缀始终可以命中提示词缓存
+EXECUTOR_CONTEXT_PROMPT = """
 # 原始问题:
 {question}
 
@@ -66,26 +87,48 @@ EXECUTOR_PROMPT_TEMPLATE = """
 {plan}
 
 # 历史步骤与结果:
-{history}
+"""
 
+EXECUTOR_USER_PROMPT = """
 # 当前步骤:
 {current_step}
 
-请仅输出针对"当前步骤"的回答:
+请输出针对"当前步骤"的回答:
 """
 
-EVALUATOR_PROMPT_TEMPLATE = """
-你是一位严格的AI评估专家。你的任务是评估一个子任务的执行结果。
-请根据原始问题、当前步骤以及执行结果，判断该步骤是否成功完成。
+# 重试时使用的用户提示词：系统消息中的上下文保持不变（可命中提示词缓存），
+# 只告诉模型上次的回答未通过评估，要求换一种方式回答
+EXECUTOR_RETRY_PROMPT = """
+# 当前步骤:
+{current_step}
 
-原始问题:
-{question}
+你上次的回答:
+{previous_result}
 
-当前步骤:
-{current_step}
+该回答未通过评估。请换一种方式，重新输出针对"当前步骤"的回答:
+"""
 
-执行结果:
-{result}
+# 执行与评估合并为一次调用时使用的系统提示词，上下文与用户部分复用执行器的模板
+EXEC_EVAL_SYSTEM_PROMPT = """
+你是一位顶级的AI执行专家。你的任务是严格按照给定的计划，一步步地解决问题。
+你将收到原始问题、完整的计划、以及到目前为止已经完成的步骤和结果。
+请你专注于解决"当前步骤"，不要输出任何额外的解释或对话。
+
+在给出答案之后，请另起一行，严格评估你的答案是否合理、正确，是否能够支持后续步骤的进行，
+并输出以下三种结论之一:
+
+SUCCESS - 如果步骤成功完成且结果合理。
+FAILURE_RETRY - 如果步骤失败，但可以通过重新尝试（例如，换一种方式表述）来解决。
+FAILURE_REPLAN - 如果步骤失败，且问题出在计划本身，需要回退并重新规划。
+
+请严格按照以下格式输出:
+<answer>针对当前步骤的回答</answer>
+<verdict>SUCCESS 或 FAILURE_RETRY 或 FAILURE_REPLAN</verdict>
+"""
+
+EVALUATOR_SYSTEM_PROMPT = """
+你是一位严格的AI评估专家。你的任务是评估一个子任务的执行结果。
+你将收到原始问题、当前步骤以及执行结果，请判断该步骤是否成功完成。
 
 请分析该结果是否合理、正确，并判断是否能够支持后续步骤的进行。
 你的输出必须是以下三种之一，请直接输出，不要有任何其他内容:
@@ -93,11 +136,109 @@ EVALUATOR_PROMPT_TEMPLATE = """
 SUCCESS - 如果步骤成功完成且结果合理。
 FAILURE_RETRY - 如果步骤失败，但可以通过重新尝试（例如，换一种方式表述）来解决。
 FAILURE_REPLAN - 如果步骤失败，且问题出在计划本身，需要回退并重新规划。
+"""
+
+EVALUATOR_USER_PROMPT = """
+原始问题:
+{question}
+
+当前步骤:
+{current_step}
+
+执行结果:
+{result}
 
 输出: 
 """
 
 
+# 提取计划代码块中的列表 (接受任意语言标记，如 ```python / ```json)；预编译以避免每次解析时重复编译
+_PLAN_RE = re.compile(r"```(?:\w+)?\s*(\[.*?\])\s*```", re.DOTALL)
+
+# 投票前归一化计划步骤时需要忽略的空白与标点
+_PLAN_NOISE_RE = re.compile(r"[\s\W_]+")
+
+
+def _plan_vote_key(plan: list[str]) -> tuple:
+    """计划的投票键：忽略大小写、空白与标点，使仅措辞格式不同的计划能够算作同一票。"""
+    return tuple(_PLAN_NOISE_RE.sub("", step).casefold() for step in plan)
+
+
+VERDICTS = ("SUCCESS", "FAILURE_RETRY", "FAILURE_REPLAN")
+
+
+# 单次扫描即可找到第一个评估标签，无需先复制出一份大写字符串
+_VERDICT_RE = re.compile(r"FAILURE_RETRY|FAILURE_REPLAN|SUCCESS", re.IGNORECASE)
+
+
+def _first_verdict(text: str):
+    """返回文本中出现的第一个评估标签，未出现时返回None。"""
+    match = _VERDICT_RE.search(text or "")
+    return match.group(0).upper() if match else None
+
+
+# 结果以这些拒答或报错形式开头时，基本可以判定该步骤没有完成。
+# 只匹配开头：正文中出现 "error"、"不知道" 等字样的正常回答仍交给LLM评估
+_NEGATIVE_PREFIXES = ("抱歉", "对不起", "我无法", "无法完成", "error:", "sorry,")
+
+
+def _quick_verdict(result: str):
+    """
+    用廉价的字符串检查处理显而易见失败的结果，无需调用LLM。
+    返回None表示无法判断，需要交给LLM评估。
+    智能体在每一步执行后都会先调用它 (合并与分离模式皆然)；Evaluator 也会调用，以便单独使用时同样生效。
+    """
+    stripped = result.strip() if result else ""
+    if not stripped:
+        return "FAILURE_RETRY"
+    if stripped.lower().startswith(_NEGATIVE_PREFIXES):
+        return "FAILURE_RETRY"
+    return None
+
+
+_ANSWER_RE = re.compile(r"<answer>(.*?)</answer>", re.DOTALL)
+_VERDICT_TAG_RE = re.compile(r"<verdict>\s*(\w+)\s*</verdict>", re.IGNORECASE)
+
+
+def _split_answer_verdict(text: str) -> tuple[str, str]:
+    """
+    从合并调用的输出中拆出答案与评估结论。
+    未找到合法的 <verdict> 标签时，结论为None。
+    """
+    match = _VERDICT_TAG_RE.search(text)
+    verdict = match.group(1).upper() if match else None
+    if verdict not in VERDICTS:
+        verdict = None
+
+    answer_text = _VERDICT_TAG_RE.sub("", text)
+    answer_match = _ANSWER_RE.search(answer_text)
+    answer = answer_match.group(1) if answer_match else answer_text
+    return answer.strip(), verdict
+
+
+def _prompt_version(*prompts: str) -> str:
+    """提示词内容的短哈希，作为磁盘缓存键的一部分，修改提示词后旧缓存自动失效。"""
+    return hashlib.sha1("\0".join(prompts).encode("utf-8")).hexdigest()[:12]
+
+
+_PLAN_PROMPT_VERSION = _prompt_version(PLANNER_SYSTEM_PROMPT, PLANNER_USER_PROMPT)
+_EVALUATION_PROMPT_VERSION = _prompt_version(EVALUATOR_SYSTEM_PROMPT, EVALUATOR_USER_PROMPT)
+
+
+def _plan_cache_key(args: dict) -> tuple:
+    return (
+        _PLAN_PROMPT_VERSION, args["self"].llm_client.model,
+        args["question"], args["history"], args["failure_info"],
+    )
+
+
+def _evaluation_cache_key(args: dict) -> tuple:
+    return (
+        _EVALUATION_PROMPT_VERSION, args["self"].llm_client.model,
+        args["question"], args["current_step"], args["result"][:512],
+    )
+
+
 class Planner:
     """
     规划器：负责根据问题、历史记录和失败信息生成（或重新生成）行动计划。
@@ -105,6 +246,7 @@ class Planner:
     def __init__(self, llm_client):
         self.llm_client = llm_client
 
+    @disk_cached("plan", _plan_cache_key)
     def plan(self, question: str, history: str = "无", failure_info: str = "无") -> list[str]:
         """
         根据用户问题、历史记录和失败信息生成一个行动计划。
@@ -117,25 +259,77 @@ class Planner:
         返回:
         - 一个包含步骤描述的字符串列表
         """
-        prompt = PLANNER_PROMPT_TEMPLATE.format(
-            question=question,
-            history=history,
-            failure_info=failure_info
-        )
+        messages = self._build_messages(question, history, failure_info)
         
-        messages = [{"role": "user", "content": prompt}]
+        print("--- 正在生成计划 ---")
+        response_text = self.llm_client.think(messages=messages, stream=False, verbose=False) or ""
+        
+        print(f"✅ 计划已生成:\n{response_text}")
+        return self._parse_plan(response_text)
+
+    @disk_cached("plan", _plan_cache_key)
+    async def aplan(self, question: str, history: str = "无", failure_info: str = "无") -> list[str]:
+        """
+        plan 的异步版本，参数与返回值相同。
+        """
+        messages = self._build_messages(question, history, failure_info)
         
         print("--- 正在生成计划 ---")
-        response_text = self.llm_client.think(messages=messages) or ""
+        response_text = await self.llm_client.athink(messages=messages, verbose=False) or ""
         
         print(f"✅ 计划已生成:\n{response_text}")
+        return self._parse_plan(response_text)
+
+    def plan_k(self, question: str, history: str = "无", failure_info: str = "无",
+               k: int = 3, temperature: float = 0.7) -> list[str]:
+        """
+        并发采样 k 个计划，并返回出现次数最多的一个 (self-consistency)。
+        参数与 plan 相同，k 为采样次数。
+        
+        投票基于归一化后的步骤文本，只能合并格式上的差异。自由文本的计划在较高温度下
+        很少逐步一致，此时每个计划各得一票，结果退化为第一个成功解析的计划。
+        """
+        messages = self._build_messages(question, history, failure_info)
+        
+        print(f"--- 正在并发生成 {k} 个候选计划 ---")
+        responses = self.llm_client.think_many([messages] * k, temperature=temperature)
+        plans = [p for p in (self._parse_plan(r or "") for r in responses) if p]
+        if not plans:
+            return []
         
-        # 解析LLM输出的列表字符串
+        keys = [_plan_vote_key(p) for p in plans]
+        # 票数相同时 most_common 保持首次出现的顺序，因此会选中最先解析出的计划
+        key, votes = Counter(keys).most_common(1)[0]
+        plan = plans[keys.index(key)]
+        print(f"✅ 计划已生成 ({votes}/{k} 票):\n{plan}")
+        return plan
+
+    def _build_messages(self, question: str, history: str, failure_info: str) -> list[dict]:
+        prompt = PLANNER_USER_PROMPT.format(
+            question=question,
+            history=history,
+            failure_info=failure_info
+        )
+        return [
+            {"role": "system", "content": PLANNER_SYSTEM_PROMPT},
+            {"role": "user", "content": prompt},
+        ]
+
+    def _parse_plan(self, response_text: str) -> list[str]:
+        """解析LLM输出的列表字符串，结果不是字符串列表时返回空计划。"""
+        match = _PLAN_RE.search(response_text)
+        plan_str = match.group(1) if match else response_text
         try:
-            plan_str = response_text.split("```python")[1].split("```")[0].strip()
-            plan = ast.literal_eval(plan_str)
-            return plan if isinstance(plan, list) else []
-        except (ValueError, SyntaxError, IndexError) as e:
+            # 计划通常就是一个JSON字符串数组，优先使用C实现的 json.loads，
+            # 仅在其失败时（例如单引号字符串）回退到 ast.literal_eval
+            try:
+                plan = json.loads(plan_str)
+            except json.JSONDecodeError:
+                plan = ast.literal_eval(plan_str)
+            if not isinstance(plan, list) or not all(isinstance(step, str) for step in plan):
+                return []
+            return plan
+        except (ValueError, SyntaxError) as e:
             print(f"❌ 解析计划时出错: {e}")
             print(f"原始响应: {response_text}")
             return []
@@ -147,9 +341,13 @@ class Planner:
 class Evaluator:
     """
     评估器：负责评估执行结果，并决定下一步动作。
+    显而易见失败的结果 (为空、以道歉或报错开头) 直接判定，无需调用LLM；
+    重试与重规划时常会以几乎相同的输入再次评估，因此评估结论会被语义缓存复用：
+    问题与步骤必须完全相同，执行结果语义相近即可命中。
     """
-    def __init__(self, llm_client):
+    def __init__(self, llm_client, cache: SemanticCache = None):
         self.llm_client = llm_client
+        self._eval_cache = cache if cache is not None else SemanticCache()
 
     def evaluate(self, question: str, current_step: str, result: str) -> str:
         """
@@ -160,19 +358,107 @@ class Evaluator:
         - "FAILURE_RETRY": 步骤失败，可重试
         - "FAILURE_REPLAN": 步骤失败，需要重新规划
         """
-        prompt = EVALUATOR_PROMPT_TEMPLATE.format(
-            question=question, current_step=current_step, result=result
+        quick = _quick_verdict(result)
+        if quick is not None:
+            print(f"⚡ 快速评估: {quick}")
+            return quick
+
+        scope = self._cache_scope(question, current_step)
+        cached = self._eval_cache.get(result, scope)
+        if cached is not None:
+            print(f"🗃️ 命中评估缓存: {cached}")
+            return cached
+
+        try:
+            return self._finish(result, scope, self._judge(question, current_step, result))
+        finally:
+            # 未写入缓存时 (调用失败或被中断)，丢弃 get 为其暂存的向量
+            self._eval_cache.discard(result, scope)
+
+    async def aevaluate(self, question: str, current_step: str, result: str) -> str:
+        """
+        evaluate 的异步版本，参数与返回值相同。
+        """
+        quick = _quick_verdict(result)
+        if quick is not None:
+            print(f"⚡ 快速评估: {quick}")
+            return quick
+
+        scope = self._cache_scope(question, current_step)
+        cached = await self._eval_cache.aget(result, scope)
+        if cached is not None:
+            print(f"🗃️ 命中评估缓存: {cached}")
+            return cached
+
+        try:
+            return self._finish(result, scope, await self._ajudge(question, current_step, result))
+        finally:
+            # 未写入缓存时 (调用失败，或推测执行作废而被取消)，丢弃 aget 为其暂存的向量
+            self._eval_cache.discard(result, scope)
+
+    def evaluate_k(self, question: str, current_step: str, result: str,
+                   k: int = 3, temperature: float = 0.7) -> str:
+        """
+        并发采样 k 次评估结论并多数投票 (self-consistency)，返回值与 evaluate 相同。
+        """
+        quick = _quick_verdict(result)
+        if quick is not None:
+            return quick
+
+        messages = self._build_messages(question, current_step, result)
+        responses = self.llm_client.think_many(
+            [messages] * k, temperature=temperature, max_tokens=8, stop=["\n"]
         )
-        messages = [{"role": "user", "content": prompt}]
-        response_text = self.llm_client.think(messages=messages) or "FAILURE_REPLAN"
-        
-        # 解析评估结果
-        if "SUCCESS" in response_text.upper():
-            return "SUCCESS"
-        elif "FAILURE_RETRY" in response_text.upper():
-            return "FAILURE_RETRY"
-        else:
+        verdicts = [self._parse_evaluation(r) for r in responses if r is not None]
+        if not verdicts:
+            return "FAILURE_REPLAN"
+        return Counter(verdicts).most_common(1)[0][0]
+
+    def _cache_scope(self, question: str, current_step: str) -> str:
+        """问题与步骤只做精确匹配，语义比较只针对执行结果本身。"""
+        return f"{question}\n{current_step}"
+
+    def _finish(self, result: str, scope: str, evaluation: str) -> str:
+        """只有模型成功给出结论时才写入缓存，否则按需要重规划处理。"""
+        if evaluation is None:
             return "FAILURE_REPLAN"
+        self._eval_cache.put(result, evaluation, scope)
+        return evaluation
+
+    @disk_cached("evaluate", _evaluation_cache_key)
+    def _judge(self, question: str, current_step: str, result: str) -> str:
+        """
+        调用LLM给出评估结论。
+        模型调用失败或回复中没有合法标签时返回None，这样的结论不会被写入任何缓存。
+        """
+        messages = self._build_messages(question, current_step, result)
+        # 只需要一个标签：限制生成长度；无人实时观看，因此不使用流式输出
+        response_text = self.llm_client.think(
+            messages=messages, max_tokens=8, stop=["\n"], stream=False, verbose=False
+        )
+        return _first_verdict(response_text)
+
+    @disk_cached("evaluate", _evaluation_cache_key)
+    async def _ajudge(self, question: str, current_step: str, result: str) -> str:
+        """_judge 的异步版本。"""
+        messages = self._build_messages(question, current_step, result)
+        response_text = await self.llm_client.athink(
+            messages=messages, max_tokens=8, stop=["\n"], verbose=False
+        )
+        return _first_verdict(response_text)
+
+    def _build_messages(self, question: str, current_step: str, result: str) -> list[dict]:
+        prompt = EVALUATOR_USER_PROMPT.format(
+            question=question, current_step=current_step, result=result
+        )
+        return [
+            {"role": "system", "content": EVALUATOR_SYSTEM_PROMPT},
+            {"role": "user", "content": prompt},
+        ]
+
+    def _parse_evaluation(self, response_text: str) -> str:
+        """解析评估结果，未找到任何标签时按需要重规划处理。"""
+        return _first_verdict(response_text) or "FAILURE_REPLAN"
 
 
 class DynamicPlanAndSolveAgent:
@@ -183,17 +469,36 @@ class DynamicPlanAndSolveAgent:
     1. 每执行完一个步骤，由 Evaluator 评估结果
     2. 如果评估失败，可以触发重试或重规划
     3. 重规划时会带上历史记录和失败信息，让 Planner 生成更智能的新计划
+    4. 默认将执行与评估合并为一次LLM调用 (merge_evaluation=True)，
+       每个步骤只需一次往返；模型未给出结论时回退到独立的 Evaluator
+    5. arun 支持推测执行 (enable_speculation=True)：在执行第 k 步的同时预先执行第 k+1 步，
+       第 k 步成功时直接采用预先执行的结果，否则丢弃。成功率高时可将延迟减半，
+       代价是每一步的token消耗加倍，且预先执行的步骤看不到第 k 步的结果
     """
     MAX_REPLANS = 3  # 最大重规划次数
     MAX_RETRIES = 2  # 单步骤最大重试次数
+    SUMMARY_MAX_CHARS = 512  # 写回提示词的步骤结果的最大长度
+    RETRY_PREVIEW_CHARS = 400  # 重试时回传给模型的上次回答的最大长度
+    RETRY_TEMPERATURE = 0.7  # 重试时提高温度，让模型给出与上次不同的回答
 
-    def __init__(self, llm_client):
+    def __init__(self, llm_client, merge_evaluation: bool = True, enable_speculation: bool = False):
         self.llm_client = llm_client
+        self.merge_evaluation = merge_evaluation
+        self.enable_speculation = enable_speculation
         self.planner = Planner(self.llm_client)
         self.evaluator = Evaluator(self.llm_client)
         
-        self.history = []  # 成功完成的步骤和结果
+        # 成功完成的步骤和结果，以两个平行列表存储 (第 i 项一一对应)
+        self.history_steps = []
+        self.history_results = []  # 完整结果，仅用于最终答案
+        self.history_summaries = []  # 截断后的结果，用于构建后续提示词
         self.replan_count = 0
+        # history 格式化后的字符串，每成功一步只追加一条，避免每次从头拼接
+        self._history_str_cache = ""
+        self._history_str_len = 0  # 已写入缓存字符串的历史条数
+        # 执行器系统消息中的上下文（问题、计划与历史），每个计划构建一次
+        self._exec_context = ""
+        self._exec_context_plan = None
 
     def run(self, question: str) -> str:
         """
@@ -205,22 +510,83 @@ class DynamicPlanAndSolveAgent:
         返回:
         - 最终答案字符串
         """
+        flow = self._control_flow(question, mode="")
+        try:
+            request = next(flow)
+            while True:
+                if request[0] == "plan":
+                    response = self._generate_plan(question, failure_info=request[1])
+                else:
+                    _, plan, step_index, previous_result = request
+                    response = self._execute_and_evaluate(question, plan, plan[step_index], previous_result)
+                request = flow.send(response)
+        except StopIteration as done:
+            return done.value
+
+    async def arun(self, question: str) -> str:
+        """
+        run 的异步版本，流程与 run 完全一致，但所有 LLM 调用都通过 athink 发出。
+        多个智能体实例的 arun 可以通过 asyncio.gather 并发执行。
+        开启 enable_speculation 时，会在执行当前步骤的同时预先执行下一步骤。
+        
+        参数:
+        - question: 用户的问题
+        
+        返回:
+        - 最终答案字符串
+        """
+        flow = self._control_flow(question, mode=" (异步)")
+        next_task = None  # 预先执行的下一步骤任务（仅在开启推测执行时使用）
+        try:
+            request = next(flow)
+            while True:
+                if request[0] == "plan":
+                    response = await self._agenerate_plan(question, failure_info=request[1])
+                else:
+                    _, plan, step_index, previous_result = request
+                    # 上一步成功时，本步骤可能已经被预先执行，直接复用其任务
+                    current_task = next_task or asyncio.create_task(
+                        self._aexecute_and_evaluate(question, plan, plan[step_index], previous_result)
+                    )
+                    next_task = None
+                    if self.enable_speculation and step_index + 1 < len(plan):
+                        next_task = asyncio.create_task(
+                            self._aexecute_and_evaluate(question, plan, plan[step_index + 1])
+                        )
+                    response = await current_task
+                    if response[1] != "SUCCESS" and next_task is not None:
+                        # 当前步骤未成功，预先执行的结果作废
+                        next_task.cancel()
+                        next_task = None
+                request = flow.send(response)
+        except StopIteration as done:
+            return done.value
+
+    def _control_flow(self, question: str, mode: str):
+        """
+        执行、重试与重规划的控制流程，由 run 与 arun 共同驱动。
+        
+        这是一个生成器：需要调用LLM时 yield 一个请求，由驱动方完成调用后把结果 send 回来:
+        - ("plan", failure_info) -> 新的计划列表
+        - ("step", plan, step_index, previous_result) -> (执行结果, 评估结论)
+        流程结束时通过 StopIteration.value 返回最终答案。
+        """
         print(f"\n{'='*50}")
-        print(f"[动态规划Agent] 开始处理问题")
+        print(f"[动态规划Agent] 开始处理问题{mode}")
         print(f"{'='*50}")
         print(f"问题: {question}\n")
         
         # 重置状态
-        self.history = []
-        self.replan_count = 0
+        self._reset()
         
         # 1. 生成初始计划
-        plan = self._generate_plan(question, failure_info="无")
+        plan = yield ("plan", "无")
         if not plan:
             return "无法生成初始计划。"
 
         step_index = 0
         retry_count = 0  # 当前步骤的重试计数器
+        previous_result = None  # 当前步骤上一次未通过评估的结果，用于构建重试提示词
         
         while step_index < len(plan):
             current_step = plan[step_index]
@@ -228,21 +594,19 @@ class DynamicPlanAndSolveAgent:
             print(f"📌 正在执行步骤 {step_index + 1}/{len(plan)}: {current_step}")
             print(f"{'─'*40}")
 
-            # 2. 执行单个步骤
-            result = self._execute_step(question, plan, current_step)
+            # 2. 执行单个步骤并评估执行结果
+            result, evaluation = yield ("step", plan, step_index, previous_result)
             
             # 安全地截取结果用于显示
             display_result = result[:150] + "..." if len(result) > 150 else result
             print(f"   📋 步骤结果: {display_result}")
-
-            # 3. 评估执行结果
-            evaluation = self.evaluator.evaluate(question, current_step, result)
             print(f"   🔍 评估结论: {evaluation}")
 
             if evaluation == "SUCCESS":
-                self.history.append({"step": current_step, "result": result})
+                self._record_success(current_step, result)
                 step_index += 1
                 retry_count = 0  # 重置重试计数器
+                previous_result = None
                 print(f"   ✅ 步骤 {step_index} 已成功完成")
 
             elif evaluation == "FAILURE_RETRY":
@@ -252,6 +616,7 @@ class DynamicPlanAndSolveAgent:
                     evaluation = "FAILURE_REPLAN"  # 降级为重规划
                 else:
                     print(f"   ⚠️ 步骤失败，正在重试 ({retry_count}/{self.MAX_RETRIES})...")
+                    previous_result = result
                     continue  # 重新执行当前步骤
 
             # 处理重规划（包括从 FAILURE_RETRY 降级来的情况）
@@ -262,18 +627,19 @@ class DynamicPlanAndSolveAgent:
                     return "达到最大重规划次数，任务失败。"
 
                 print(f"\n   🔄 触发重规划 (第 {self.replan_count}/{self.MAX_REPLANS} 次)...")
-                failure_info = f"在执行步骤 '{current_step}' 时失败。\n执行结果/原因: {result}"
+                failure_info = f"在执行步骤 '{current_step}' 时失败。\n执行结果/原因: {self._summarize(result)}"
                 
                 # 4. 动态重规划
-                plan = self._generate_plan(question, failure_info=failure_info)
+                plan = yield ("plan", failure_info)
                 if not plan:
                     return "重规划失败，无法生成新计划。"
                     
                 step_index = 0  # 从新计划的第一步开始
                 retry_count = 0  # 重置重试计数器
+                previous_result = None
 
         # 所有步骤执行完成
-        final_answer = self.history[-1]["result"] if self.history else "未能完成任务"
+        final_answer = self.history_results[-1] if self.history_results else "未能完成任务"
         print(f"\n{'='*50}")
         print(f"🎉 任务完成!")
         print(f"{'='*50}")
@@ -291,23 +657,23 @@ class DynamicPlanAndSolveAgent:
         返回:
         - 计划步骤列表
         """
-        # 将历史记录格式化为字符串
-        if self.history:
-            history_str = "\n".join([
-                f"- 步骤: {h['step']}\n  结果: {h['result']}" 
-                for h in self.history
-            ])
-        else:
-            history_str = "无"
-        
-        # 调用 Planner 生成计划
         return self.planner.plan(
             question=question,
-            history=history_str,
+            history=self._format_plan_history(),
             failure_info=failure_info
         )
 
-    def _execute_step(self, question: str, plan: list[str], step: str) -> str:
+    async def _agenerate_plan(self, question: str, failure_info: str) -> list[str]:
+        """
+        _generate_plan 的异步版本。
+        """
+        return await self.planner.aplan(
+            question=question,
+            history=self._format_plan_history(),
+            failure_info=failure_info
+        )
+
+    def _execute_step(self, question: str, plan: list[str], step: str, previous_result: str = None) -> str:
         """
         执行单个步骤。
         
@@ -315,30 +681,146 @@ class DynamicPlanAndSolveAgent:
         - question: 用户的原始问题
         - plan: 当前的完整计划
         - step: 当前要执行的步骤
+        - previous_result: 重试时传入上一次未通过评估的结果，此时只发送简短的重试提示词
         
         返回:
         - 执行结果字符串
         """
-        # 格式化历史记录
-        if self.history:
-            history_str = "\n".join([
-                f"步骤: {h['step']}\n结果: {h['result']}" 
-                for h in self.history
-            ])
-        else:
-            history_str = "无"
-        
-        # 格式化计划列表为可读字符串
-        plan_str = "\n".join([f"{i+1}. {s}" for i, s in enumerate(plan)])
+        messages = self._build_executor_messages(question, plan, step, previous_result=previous_result)
+        return self.llm_client.think(messages=messages, temperature=self._step_temperature(previous_result)) or ""
+
+    async def _aexecute_step(self, question: str, plan: list[str], step: str, previous_result: str = None) -> str:
+        """
+        _execute_step 的异步版本。
+        """
+        messages = self._build_executor_messages(question, plan, step, previous_result=previous_result)
+        return await self.llm_client.athink(
+            messages=messages, temperature=self._step_temperature(previous_result)
+        ) or ""
+
+    def _execute_and_evaluate(self, question: str, plan: list[str], step: str,
+                              previous_result: str = None) -> tuple[str, str]:
+        """
+        执行单个步骤并评估其结果。参数同 _execute_step。
         
-        prompt = EXECUTOR_PROMPT_TEMPLATE.format(
-            question=question,
-            plan=plan_str,
-            history=history_str,
-            current_step=step
-        )
-        messages = [{"role": "user", "content": prompt}]
-        return self.llm_client.think(messages=messages) or ""
+        返回:
+        - (执行结果字符串, 评估结论)
+        """
+        if not self.merge_evaluation:
+            result = self._execute_step(question, plan, step, previous_result)
+            evaluation = None
+        else:
+            messages = self._build_executor_messages(question, plan, step, EXEC_EVAL_SYSTEM_PROMPT, previous_result)
+            response_text = self.llm_client.think(messages=messages, temperature=self._step_temperature(previous_result))
+            result, evaluation = _split_answer_verdict(response_text or "")
+
+        # 显而易见失败的结果直接判定，无需调用LLM；合并模式下也覆盖模型不可全信的自评
+        evaluation = _quick_verdict(result) or evaluation
+        if evaluation is None:
+            # 分离模式，或模型未按格式给出结论时，交给独立的 Evaluator
+            evaluation = self.evaluator.evaluate(question, step, result)
+        return result, evaluation
+
+    async def _aexecute_and_evaluate(self, question: str, plan: list[str], step: str,
+                                     previous_result: str = None) -> tuple[str, str]:
+        """
+        _execute_and_evaluate 的异步版本。
+        """
+        if not self.merge_evaluation:
+            result = await self._aexecute_step(question, plan, step, previous_result)
+            evaluation = None
+        else:
+            messages = self._build_executor_messages(question, plan, step, EXEC_EVAL_SYSTEM_PROMPT, previous_result)
+            response_text = await self.llm_client.athink(
+                messages=messages, temperature=self._step_temperature(previous_result)
+            )
+            result, evaluation = _split_answer_verdict(response_text or "")
+
+        # 显而易见失败的结果直接判定，无需调用LLM；合并模式下也覆盖模型不可全信的自评
+        evaluation = _quick_verdict(result) or evaluation
+        if evaluation is None:
+            # 分离模式，或模型未按格式给出结论时，交给独立的 Evaluator
+            evaluation = await self.evaluator.aevaluate(question, step, result)
+        return result, evaluation
+
+    def _step_temperature(self, previous_result: str = None) -> float:
+        """首次执行使用确定性输出；重试时提高温度，避免得到与上次相同的回答。"""
+        return self.RETRY_TEMPERATURE if previous_result is not None else 0
+
+    def _reset(self):
+        """在每次运行开始时清空历史记录与计数器。"""
+        self.history_steps = []
+        self.history_results = []  # 完整结果，仅用于最终答案
+        self.history_summaries = []  # 截断后的结果，用于构建后续提示词
+        self.replan_count = 0
+        self._history_str_cache = ""
+        self._history_str_len = 0
+        self._exec_context = ""
+        self._exec_context_plan = None
+
+    def _record_success(self, step: str, result: str):
+        """
+        记录一个成功完成的步骤，并增量更新格式化后的历史字符串。
+        重规划不会改变已完成步骤的含义，因此缓存无需重建。
+        历史字符串中只写入截断后的摘要，避免长结果让后续每个提示词线性膨胀。
+        """
+        summary = self._summarize(result)
+        self.history_steps.append(step)
+        self.history_results.append(result)
+        self.history_summaries.append(summary)
+        entry = f"- 步骤: {step}\n  结果: {summary}\n"
+        self._history_str_cache += entry
+        self._history_str_len += 1
+        if self._exec_context:
+            self._exec_context += entry
+
+    def _summarize(self, result: str) -> str:
+        """截断过长的步骤结果，供后续提示词使用。"""
+        if len(result) <= self.SUMMARY_MAX_CHARS:
+            return result
+        return result[:self.SUMMARY_MAX_CHARS] + "...(已截断)"
+
+    def _format_plan_history(self) -> str:
+        """
+        返回格式化后的历史记录字符串，没有历史时返回"无"。
+        仅当历史列表被外部直接修改、与缓存不一致时才从头重建一次。
+        """
+        if self._history_str_len != len(self.history_steps):
+            self._history_str_cache = "".join(
+                f"- 步骤: {step}\n  结果: {result}\n"
+                for step, result in zip(self.history_steps, self.history_summaries)
+            )
+            self._history_str_len = len(self.history_steps)
+        return self._history_str_cache or "无"
+
+    def _build_executor_messages(self, question: str, plan: list[str], step: str,
+                                 system_prompt: str = EXECUTOR_SYSTEM_PROMPT,
+                                 previous_result: str = None) -> list[dict]:
+        """
+        构建执行器的消息。问题、计划与历史记录放在系统消息中，每个计划只构建一次，
+        之后仅随成功的步骤在末尾追加；用户消息只包含当前步骤。
+        这样系统消息的前缀在各步骤之间逐字节保持不变，支持前缀缓存的服务商可以复用
+        已计算过的预填充结果。注意每一步发送的 token 数仍随历史线性增长，节省的只是预填充计算。
+        重试时用户消息换成简短的重试提示词，附带截断后的上一次回答。
+        """
+        if plan is not self._exec_context_plan:
+            # 格式化计划列表为可读字符串
+            plan_str = "\n".join([f"{i+1}. {s}" for i, s in enumerate(plan)])
+            history_str = self._format_plan_history() if self.history_steps else ""
+            self._exec_context = EXECUTOR_CONTEXT_PROMPT.format(question=question, plan=plan_str) + history_str
+            self._exec_context_plan = plan
+
+        if previous_result is None:
+            prompt = EXECUTOR_USER_PROMPT.format(current_step=step)
+        else:
+            prompt = EXECUTOR_RETRY_PROMPT.format(
+                current_step=step,
+                previous_result=previous_result[:self.RETRY_PREVIEW_CHARS],
+            )
+        return [
+            {"role": "system", "content": system_prompt + self._exec_context},
+            {"role": "user", "content": prompt},
+        ]
 
 
 if __name__ == "__main__":
@@ -348,9 +830,6 @@ if __name__ == "__main__":
     # 初始化LLM客户端
     llm_client = BaseAgent()
     
-    # 创建动态规划智能体实例
-    agent = DynamicPlanAndSolveAgent(llm_client)
-    
     # ============================================================
     # 测试案例集：展现动态重规划Agent的威力
     # ============================================================
@@ -435,7 +914,14 @@ if __name__ == "__main__":
     print("="*60)
     
     # 默认运行案例2（最能体现动态重规划的价值）
-    selected_case = case_2
+    # 可以加入更多案例，例如 [case_1, case_2, case_3, case_4]，它们会并发运行，
+    # 总耗时约等于最慢的一个案例，而不是所有案例耗时之和
+    selected_cases = [case_2]
+    
+    async def main():
+        # 每个案例使用独立的智能体实例，避免共享 history 等运行状态
+        agents = [DynamicPlanAndSolveAgent(llm_client) for _ in selected_cases]
+        return await asyncio.gather(*(agent.arun(case) for agent, case in zip(agents, selected_cases)))
     
     # 运行选中的案例
-    agent.run(selected_case)
\ No newline at end of file
+    asyncio.run(main())
\ No newline at end of file
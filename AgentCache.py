@@ -0,0 +1,353 @@
+"""
+Hello Agents 缓存模块
+
+为智能体的LLM调用提供缓存，避免对相同或近似相同的输入重复调用模型。
+- SemanticCache: 进程内的语义缓存。依赖可选的 sentence-transformers
+  (pip install sentence-transformers)，未安装时自动退化为仅精确匹配；
+  安装了 numba 时，相似度查找会被编译为机器码。
+- disk_cached: 跨进程、跨运行的磁盘缓存装饰器。依赖可选的 diskcache
+  (pip install diskcache)，未安装时装饰器不做任何事。
+"""
+
+import asyncio
+import functools
+import hashlib
+import inspect
+import os
+from collections import OrderedDict
+from typing import Any, Callable, Optional
+
+try:
+    import numpy as np
+    from sentence_transformers import SentenceTransformer
+except ImportError:
+    np = None
+    SentenceTransformer = None
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+try:
+    import diskcache
+except ImportError:
+    diskcache = None
+
+DISK_CACHE_DIR = os.path.expanduser("~/.hello_agents_plan_cache")
+DISK_CACHE_EXPIRE = 86400  # 磁盘缓存的过期时间（秒）
+
+_disk_cache = None
+
+
+if njit is not None:
+    @njit(cache=True, fastmath=True)
+    def _best_match(query, matrix, row_scopes, scope):
+        """
+        在属于 scope 的行中找出与 query 点积最大的一行，返回 (行号, 点积)。
+        没有任何行属于 scope 时行号为 -1。
+        """
+        best = -2.0
+        idx = -1
+        for i in range(matrix.shape[0]):
+            if row_scopes[i] != scope:
+                continue
+            s = 0.0
+            for j in range(matrix.shape[1]):
+                s += query[j] * matrix[i, j]
+            if s > best:
+                best = s
+                idx = i
+        return idx, best
+else:
+    def _best_match(query, matrix, row_scopes, scope):
+        """
+        在属于 scope 的行中找出与 query 点积最大的一行，返回 (行号, 点积)。
+        没有任何行属于 scope 时行号为 -1。
+        """
+        scores = np.where(row_scopes == scope, matrix @ query, -np.inf)
+        idx = int(np.argmax(scores))
+        if scores[idx] == -np.inf:
+            return -1, -2.0
+        return idx, float(scores[idx])
+
+
+@functools.lru_cache(maxsize=None)
+def _load_embedding_model(model_name: str):
+    """同一个向量模型在进程内只加载一次，供所有 SemanticCache 实例共享。"""
+    return SentenceTransformer(model_name)
+
+
+@functools.lru_cache(maxsize=None)
+def _get_embedding_batcher(model_name: str) -> "EmbeddingBatcher":
+    """
+    同一个向量模型共享一个 EmbeddingBatcher。
+    若每个 SemanticCache 各自持有一个，不同智能体的并发请求无法合并，每批只有一条文本，
+    却仍要为等待窗口付出延迟。
+    """
+    return EmbeddingBatcher(_load_embedding_model(model_name))
+
+
+class SemanticCache:
+    """
+    语义缓存：以文本的向量表示为键保存结果。
+
+    每条记录都属于一个作用域 (scope)，只在同一作用域内查找:
+    - 精确匹配：作用域与文本都相同时直接命中，无需计算向量
+    - 语义匹配：同一作用域内，与已缓存文本的余弦相似度不低于 threshold 时命中
+
+    作用域用于放置调用方所有记录都共享的长文本（例如原始问题），
+    只对真正需要比较的短文本计算向量，避免共享部分主导相似度。
+
+    缓存按 LRU 策略最多保留 max_entries 条记录。
+    所有向量保存在一个预先分配、按需倍增的连续矩阵中，淘汰记录时直接复用其所在行。
+    """
+    INITIAL_CAPACITY = 16  # 向量矩阵的初始行数
+
+    def __init__(self, model_name: str = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2",
+                 threshold: float = 0.95, max_entries: int = 512):
+        """
+        Args:
+            model_name: 用于计算文本向量的 sentence-transformers 模型，默认使用支持中文的多语言模型
+            threshold: 语义命中所需的最低余弦相似度
+            max_entries: 最多缓存的记录条数
+        """
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.model = _load_embedding_model(model_name) if SentenceTransformer else None
+
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (矩阵行号, 结果)
+        self._pending = {}    # get 未命中时算出的向量，留给随后的 put 复用 (未写入时由 discard 丢弃)
+        self._matrix = None   # 向量矩阵，前 _size 行有效
+        self._size = 0
+        self._row_keys = []   # 矩阵每一行对应的缓存键
+        self._row_scopes = None  # 矩阵每一行所属作用域的编号，与矩阵同步扩容
+        self._batcher = _get_embedding_batcher(model_name) if self.model is not None else None
+
+    def get(self, text: str, scope: str = "") -> Optional[Any]:
+        """
+        在 scope 内查找与 text 相同或语义相近的缓存结果，未命中时返回None。
+        """
+        key = self._key(text, scope)
+        if key in self._entries:
+            return self._touch(key)
+        if self.model is None:
+            return None
+        return self._search(key, self._embed(text), scope)
+
+    async def aget(self, text: str, scope: str = "") -> Optional[Any]:
+        """
+        get 的异步版本。并发调用时，各自的向量计算会被合并为一次批量 encode。
+        """
+        key = self._key(text, scope)
+        if key in self._entries:
+            return self._touch(key)
+        if self.model is None:
+            return None
+        return self._search(key, await self._batcher.encode(text), scope)
+
+    def put(self, text: str, value: Any, scope: str = ""):
+        """
+        在 scope 内保存 text 对应的结果，超出容量时淘汰最久未使用的记录。
+        """
+        key = self._key(text, scope)
+        embedding = self._pending.pop(key, None)
+        if key in self._entries:
+            # 文本相同则向量也相同，只需更新结果
+            self._entries[key] = (self._entries[key][0], value)
+            self._entries.move_to_end(key)
+            return
+
+        row = None
+        if self.model is not None:
+            if embedding is None:
+                embedding = self._embed(text)
+            row = self._store(key, embedding, self._scope_id(scope))
+
+        self._entries[key] = (row, value)
+        if len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def discard(self, text: str, scope: str = ""):
+        """未命中后决定不写入缓存时调用，丢弃 get 为其暂存的向量。"""
+        self._pending.pop(self._key(text, scope), None)
+
+    def _touch(self, key: str) -> Any:
+        """标记记录为最近使用并返回其结果。"""
+        self._entries.move_to_end(key)
+        return self._entries[key][1]
+
+    def _search(self, key: str, embedding, scope: str) -> Optional[Any]:
+        """在同一作用域已缓存的向量中查找与 embedding 最相似的记录。"""
+        if self._size > 0:
+            # 向量已归一化，点积即余弦相似度
+            best, score = _best_match(
+                embedding, self._matrix[:self._size], self._row_scopes[:self._size], self._scope_id(scope)
+            )
+            if best >= 0 and score >= self.threshold:
+                return self._touch(self._row_keys[best])
+
+        # 未命中：调用方随后通常会 put 这条文本，届时复用已算出的向量
+        self._pending[key] = embedding
+        return None
+
+    def _store(self, key: str, embedding, scope_id: int) -> int:
+        """将向量写入矩阵并返回行号；缓存已满时复用最久未使用记录的行。"""
+        if self._size == self.max_entries:
+            _, (row, _) = self._entries.popitem(last=False)
+        else:
+            self._ensure_capacity(embedding.shape[0])
+            row = self._size
+            self._size += 1
+            self._row_keys.append(None)
+
+        self._matrix[row] = embedding
+        self._row_scopes[row] = scope_id
+        self._row_keys[row] = key
+        return row
+
+    def _ensure_capacity(self, dim: int):
+        """保证矩阵还有空行，不足时容量翻倍（不超过 max_entries），保持内存连续。"""
+        if self._matrix is None:
+            capacity = min(self.INITIAL_CAPACITY, self.max_entries)
+            self._matrix = np.empty((capacity, dim), dtype=np.float32)
+            self._row_scopes = np.empty(capacity, dtype=np.int64)
+        elif self._size == self._matrix.shape[0]:
+            capacity = min(self._matrix.shape[0] * 2, self.max_entries)
+            grown = np.empty((capacity, dim), dtype=np.float32)
+            grown[:self._size] = self._matrix[:self._size]
+            self._matrix = grown
+            grown_scopes = np.empty(capacity, dtype=np.int64)
+            grown_scopes[:self._size] = self._row_scopes[:self._size]
+            self._row_scopes = grown_scopes
+
+    def _key(self, text: str, scope: str) -> str:
+        return hashlib.sha1(f"{scope}\x00{text}".encode("utf-8")).hexdigest()
+
+    def _scope_id(self, scope: str) -> int:
+        """将作用域映射为一个 int64 编号，便于在编译后的查找循环中比较。"""
+        return int.from_bytes(hashlib.sha1(scope.encode("utf-8")).digest()[:8], "little", signed=True)
+
+    def _embed(self, text: str):
+        embedding = self.model.encode(text, convert_to_numpy=True, normalize_embeddings=True)
+        return np.ascontiguousarray(embedding, dtype=np.float32)
+
+
+class EmbeddingBatcher:
+    """
+    把一个短时间窗口内的多个向量计算请求合并为一次批量 encode，
+    摊薄每次调用模型的固定开销。需要在事件循环中使用，后台任务在首次请求时启动。
+    """
+    def __init__(self, model, window: float = 0.015, max_batch: int = 64):
+        """
+        Args:
+            model: sentence-transformers 模型
+            window: 收到第一个请求后等待更多请求加入的时间（秒）
+            max_batch: 单次批量计算的最大文本数
+        """
+        self.model = model
+        self.window = window
+        self.max_batch = max_batch
+        self._loop = None
+        self._queue = None
+        self._worker = None
+
+    async def encode(self, text: str):
+        """计算单条文本的归一化向量，实际计算会与同一时间窗口内的其他请求合并进行。"""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._worker.done():
+            # 每个事件循环各自拥有队列与后台任务
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._worker = loop.create_task(self._run())
+
+        future = loop.create_future()
+        await self._queue.put((text, future))
+        return await future
+
+    async def _run(self):
+        while True:
+            batch = [await self._queue.get()]
+            await asyncio.sleep(self.window)
+            while len(batch) < self.max_batch and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+
+            texts = [text for text, _ in batch]
+            try:
+                # 在线程中计算，避免阻塞事件循环
+                embeddings = await asyncio.to_thread(
+                    self.model.encode, texts, batch_size=len(texts),
+                    convert_to_numpy=True, normalize_embeddings=True,
+                )
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            for (_, future), embedding in zip(batch, embeddings):
+                if not future.done():
+                    future.set_result(np.ascontiguousarray(embedding, dtype=np.float32))
+
+
+def _get_disk_cache():
+    """延迟创建全局共享的磁盘缓存，未安装 diskcache 时返回None。"""
+    global _disk_cache
+    if _disk_cache is None and diskcache is not None:
+        _disk_cache = diskcache.Cache(DISK_CACHE_DIR)
+    return _disk_cache
+
+
+def disk_cached(namespace: str, key_func: Callable[[dict], tuple], expire: int = DISK_CACHE_EXPIRE):
+    """
+    将函数的返回值缓存到磁盘，输入相同时直接返回缓存结果，跳过LLM调用。
+    同时支持普通函数与协程函数；返回值为空 (None、[]、"") 时视为失败，不写入缓存。
+
+    Args:
+        namespace: 缓存命名空间，同步与异步版本使用同一个命名空间即可共享缓存
+        key_func: 接收绑定后的参数字典 (含默认值)，返回参与计算缓存键的字段元组
+        expire: 缓存过期时间（秒）
+    """
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        def make_key(args, kwargs) -> str:
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            parts = [namespace, *map(str, key_func(bound.arguments))]
+            return hashlib.sha256("\x00".join(parts).encode("utf-8")).hexdigest()
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                cache = _get_disk_cache()
+                if cache is None:
+                    return await func(*args, **kwargs)
+                key = make_key(args, kwargs)
+                value = cache.get(key)
+                if value is not None:
+                    print(f"🗃️ 命中磁盘缓存 ({namespace})")
+                    return value
+                value = await func(*args, **kwargs)
+                if value:
+                    cache.set(key, value, expire=expire)
+                return value
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            cache = _get_disk_cache()
+            if cache is None:
+                return func(*args, **kwargs)
+            key = make_key(args, kwargs)
+            value = cache.get(key)
+            if value is not None:
+                print(f"🗃️ 命中磁盘缓存 ({namespace})")
+                return value
+            value = func(*args, **kwargs)
+            if value:
+                cache.set(key, value, expire=expire)
+            return value
+        return wrapper
+
+    return decorator
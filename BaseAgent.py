@@ -5,14 +5,66 @@ Hello Agents LLM 模块
 提供一个统一的、可复用的大语言模型客户端接口。
 """
 
+import asyncio
+import atexit
+import importlib.util
 import os
-from openai import OpenAI
+import sys
+import weakref
+import httpx
+from concurrent.futures import ThreadPoolExecutor
+from openai import OpenAI, AsyncOpenAI, DefaultHttpxClient, DefaultAsyncHttpxClient
 from dotenv import load_dotenv
-from typing import List, Dict
+from typing import List, Dict, Optional
 
 # 自动加载 .env 文件中的环境变量
 load_dotenv()
 
+# 所有 BaseAgent 实例共享的 HTTP 连接池与客户端，避免每个实例都重新建立 TCP/TLS 连接
+_HTTP2 = importlib.util.find_spec("h2") is not None  # HTTP/2 需要可选的 h2 包
+_POOL_LIMITS = httpx.Limits(max_keepalive_connections=32, max_connections=64)
+_SHARED_HTTPX: Optional[httpx.Client] = None
+_CLIENTS: Dict[tuple, OpenAI] = {}
+# 异步连接池绑定在创建它的事件循环上，因此按事件循环分别共享；事件循环被回收后对应条目自动消失
+_ASYNC_CLIENTS: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[tuple, AsyncOpenAI]]" = \
+    weakref.WeakKeyDictionary()
+
+
+def _get_shared_httpx() -> httpx.Client:
+    """
+    延迟创建共享的 httpx 连接池，并在进程退出时关闭。
+    使用 DefaultHttpxClient 以保留 SDK 的默认设置 (如 follow_redirects)，只覆盖连接池相关参数。
+    """
+    global _SHARED_HTTPX
+    if _SHARED_HTTPX is None:
+        _SHARED_HTTPX = DefaultHttpxClient(http2=_HTTP2, limits=_POOL_LIMITS)
+        atexit.register(_SHARED_HTTPX.close)
+    return _SHARED_HTTPX
+
+
+def _get_client(apiKey: str, baseUrl: str, timeout: int) -> OpenAI:
+    """按 (服务地址, API密钥, 超时时间) 复用同一个 OpenAI 客户端。"""
+    key = (baseUrl, apiKey, timeout)
+    if key not in _CLIENTS:
+        _CLIENTS[key] = OpenAI(api_key=apiKey, base_url=baseUrl, timeout=timeout,
+                               http_client=_get_shared_httpx())
+    return _CLIENTS[key]
+
+
+def _get_async_client(apiKey: str, baseUrl: str, timeout: int) -> AsyncOpenAI:
+    """
+    在当前事件循环内按 (服务地址, API密钥, 超时时间) 复用同一个 AsyncOpenAI 客户端，
+    同一循环中并发运行的所有 BaseAgent 实例共享它的连接池。必须在事件循环中调用。
+    """
+    clients = _ASYNC_CLIENTS.setdefault(asyncio.get_running_loop(), {})
+    key = (baseUrl, apiKey, timeout)
+    if key not in clients:
+        clients[key] = AsyncOpenAI(
+            api_key=apiKey, base_url=baseUrl, timeout=timeout,
+            http_client=DefaultAsyncHttpxClient(http2=_HTTP2, limits=_POOL_LIMITS),
+        )
+    return clients[key]
+
 
 class BaseAgent:
     """
@@ -37,38 +89,148 @@ class BaseAgent:
         if not all([self.model, apiKey, baseUrl]):
             raise ValueError("模型ID、API密钥和服务地址必须被提供或在.env文件中定义。")
 
-        self.client = OpenAI(api_key=apiKey, base_url=baseUrl, timeout=timeout)
+        self.client = _get_client(apiKey, baseUrl, timeout)
+        # 异步客户端与事件循环绑定，由 athink 在调用时按当前循环获取
+        self._client_args = (apiKey, baseUrl, timeout)
 
-    def think(self, messages: List[Dict[str, str]], temperature: float = 0) -> str:
+    def think(self, messages: List[Dict[str, str]], temperature: float = 0,
+              max_tokens: Optional[int] = None, stop: Optional[List[str]] = None,
+              stream: bool = True, verbose: bool = True) -> str:
         """
         调用大语言模型进行思考，并返回其响应。
         
         Args:
             messages: 消息列表，格式为 [{"role": "user/system/assistant", "content": "..."}]
             temperature: 温度参数，控制输出的随机性，默认为0（确定性输出）
+            max_tokens: 最多生成的token数，默认不限制
+            stop: 停止序列，模型生成其中任意一个时立即停止
+            stream: 是否使用流式响应，默认为True。无人实时观看输出的后台调用
+                (如规划、评估) 应关闭，以一次完整的响应代替逐块处理
+            verbose: 是否打印调用过程与响应内容，默认为True
             
         Returns:
             模型的响应文本，如果发生错误则返回None
         """
-        print(f"🧠 正在调用 {self.model} 模型...")
+        if verbose:
+            print(f"🧠 正在调用 {self.model} 模型...")
         try:
             response = self.client.chat.completions.create(
                 model=self.model,
                 messages=messages,
                 temperature=temperature,
-                stream=True,
+                stream=stream,
+                **self._generation_kwargs(max_tokens, stop),
             )
+
+            if not stream:
+                return response.choices[0].message.content
             
             # 处理流式响应
-            print("✅ 大语言模型响应成功:")
+            if verbose:
+                print("✅ 大语言模型响应成功:")
             collected_content = []
             for chunk in response:
                 content = chunk.choices[0].delta.content or ""
-                print(content, end="", flush=True)
+                if verbose:
+                    self._write_chunk(content)
                 collected_content.append(content)
-            print()  # 在流式输出结束后换行
+            if verbose:
+                print(flush=True)  # 在流式输出结束后换行
             return "".join(collected_content)
 
         except Exception as e:
             print(f"❌ 调用LLM API时发生错误: {e}")
             return None
+
+    async def athink(self, messages: List[Dict[str, str]], temperature: float = 0,
+                     max_tokens: Optional[int] = None, stop: Optional[List[str]] = None,
+                     stream: bool = False, verbose: bool = True) -> str:
+        """
+        think 的异步版本，参数顺序与 think 相同。配合 asyncio.gather 可以让多个相互独立的调用并发执行，
+        从而重叠网络等待时间。
+        
+        Args:
+            messages: 消息列表，格式为 [{"role": "user/system/assistant", "content": "..."}]
+            temperature: 温度参数，控制输出的随机性，默认为0（确定性输出）
+            max_tokens: 最多生成的token数，默认不限制
+            stop: 停止序列，模型生成其中任意一个时立即停止
+            stream: 是否使用流式响应并逐字打印，默认为False（并发时逐字打印会相互交错）
+            verbose: 是否打印调用过程与响应内容，默认为True
+            
+        Returns:
+            模型的响应文本，如果发生错误则返回None
+        """
+        if verbose:
+            print(f"🧠 正在异步调用 {self.model} 模型...")
+        try:
+            aclient = _get_async_client(*self._client_args)
+            response = await aclient.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                temperature=temperature,
+                stream=stream,
+                **self._generation_kwargs(max_tokens, stop),
+            )
+
+            if not stream:
+                return response.choices[0].message.content
+
+            # 处理流式响应
+            if verbose:
+                print("✅ 大语言模型响应成功:")
+            collected_content = []
+            async for chunk in response:
+                content = chunk.choices[0].delta.content or ""
+                if verbose:
+                    self._write_chunk(content)
+                collected_content.append(content)
+            if verbose:
+                print(flush=True)  # 在流式输出结束后换行
+            return "".join(collected_content)
+
+        except Exception as e:
+            print(f"❌ 调用LLM API时发生错误: {e}")
+            return None
+
+    def think_many(self, messages_list: List[List[Dict[str, str]]], temperature: float = 0,
+                   max_workers: int = 8, **kwargs) -> List[str]:
+        """
+        使用线程池并发地发起多次调用，例如对同一提示词采样多次后投票 (self-consistency)。
+        客户端在等待网络响应时会释放GIL，因此线程可以真正地重叠等待时间。
+        
+        Args:
+            messages_list: 多组消息列表，每组对应一次调用
+            temperature: 温度参数，采样多次时应大于0，否则每次结果都相同
+            max_workers: 最大并发线程数
+            **kwargs: 透传给 think 的其他参数，如 max_tokens、stop
+            
+        Returns:
+            与 messages_list 顺序一致的响应文本列表，失败的调用对应None
+        """
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(
+                lambda messages: self.think(messages, temperature=temperature, stream=False,
+                                            verbose=False, **kwargs),
+                messages_list,
+            ))
+
+    @staticmethod
+    def _write_chunk(content: str):
+        """
+        写出一段流式内容。输出到终端时每段都立即刷新，保证有人观看时逐字显示；
+        重定向到文件或管道时交给缓冲区合并写入，避免每个token都触发一次系统调用。
+        """
+        out = sys.stdout
+        out.write(content)
+        if out.isatty():
+            out.flush()
+
+    @staticmethod
+    def _generation_kwargs(max_tokens: Optional[int], stop: Optional[List[str]]) -> dict:
+        """只传递调用方显式设置的生成参数，未设置时沿用服务端默认值。"""
+        kwargs = {}
+        if max_tokens is not None:
+            kwargs["max_tokens"] = max_tokens
+        if stop:
+            kwargs["stop"] = stop
+        return kwargs